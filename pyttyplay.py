@@ -1,14 +1,39 @@
+import io
 import os
 import gc
 import sys
 import tty
 import time
+import mmap
 import pyte
+import codecs
+import select
 import shutil
+import struct
 import tempfile
 import datetime
 import argparse
+import threading
 from math import ceil
+from array import array
+from bisect import bisect_left, bisect_right
+from itertools import islice
+
+READ_BUFFER_SIZE = 128 * 1024
+# Decompressing .bz2 into a temporary file in bigger chunks means fewer syscalls
+COPY_BUFFER_SIZE = 1024 * 1024
+# Each ttyrec frame starts with seconds, microseconds and payload length
+HEADER = struct.Struct("<III")
+# Every Nth cached frame stores the whole screen, the rest only changed lines.
+KEYFRAME_INTERVAL = 200
+# Longest wait for input before checking on the background loader again
+POLL_INTERVAL = 0.05
+# SGR codes for pyte's colour names, already as strings
+FG = {v: str(k) for k, v in pyte.graphics.FG_ANSI.items()}
+BG = {v: str(k) for k, v in pyte.graphics.BG_ANSI.items()}
+FG.update({v: str(k) for k, v in pyte.graphics.FG_AIXTERM.items()})
+BG.update({v: str(k) for k, v in pyte.graphics.BG_AIXTERM.items()})
+BG["brightmagenta"] = BG["bfightmagenta"]
 
 # Use msvcrt on Windows
 # https://stackoverflow.com/questions/2408560/non-blocking-console-input
@@ -28,6 +53,11 @@ class App:
         should_show_ui=True,
     ):
         self.temp_files = []
+        # Write encoded bytes directly to skip the text layer on every frame
+        self.out = sys.stdout.buffer
+        self.out_encoding = sys.stdout.encoding or "utf8"
+        # Created early as quit() takes it, and guess_encoding() may quit
+        self.lock = threading.Lock()
 
         if "://" in filepath:
             import urllib.request
@@ -37,21 +67,13 @@ class App:
             urllib.request.urlretrieve(filepath, tmp.name)
             filepath = tmp.name
 
-        if filepath.lower().endswith(".gz"):
-            import gzip
-
-            with gzip.open(filepath, "rb") as f_in:
-                tmp = tempfile.NamedTemporaryFile(suffix=os.path.basename(filepath[:-3]))
-                self.temp_files.append(tmp)
-                shutil.copyfileobj(f_in, tmp)
-                filepath = tmp.name
-        elif filepath.lower().endswith(".bz2"):
+        if filepath.lower().endswith(".bz2"):
             import bz2
 
             with bz2.open(filepath, "rb") as f_in:
                 tmp = tempfile.NamedTemporaryFile(suffix=os.path.basename(filepath[:-3]))
                 self.temp_files.append(tmp)
-                shutil.copyfileobj(f_in, tmp)
+                shutil.copyfileobj(f_in, tmp, COPY_BUFFER_SIZE)
                 filepath = tmp.name
 
         if os.path.exists(filepath):
@@ -60,16 +82,32 @@ class App:
             print("Could not open file", filepath)
             sys.exit(1)
 
-        self.file = open(self.filepath, "rb")
+        self.compressed_file = None
+        self.mapped_file = None
+        if self.filepath.lower().endswith(".gz"):
+            import gzip
+
+            # Stream gzip rather than decompressing to a temporary file first
+            self.compressed_file = gzip.open(self.filepath, "rb")
+            self.file = io.BufferedReader(self.compressed_file, buffer_size=READ_BUFFER_SIZE)
+        else:
+            self.file = open(self.filepath, "rb", buffering=READ_BUFFER_SIZE)
+            if os.path.getsize(self.filepath):
+                # Slicing payloads out of a map avoids a read() call per frame
+                self.mapped_file = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+                self.mapped_view = memoryview(self.mapped_file)
         self.i = 0
         self.bytes_processed = 0
-        self.timestep = timestep
+        self.min_duration = timestep / 1000000
         self.timecap_duration = timecap_duration
         self.encoding = encoding
-        self.truncated_payload = None
+        self.next_offset = 0
         if not encoding:
             self.possible_encodings = ["utf8", "cp437", "ascii"]
             self.guess_encoding()
+        # Keeps characters split across payloads until the rest arrives
+        self.decoder = codecs.getincrementaldecoder(self.encoding)(errors="replace")
+        self.pending = []
         self.total_bytes = os.stat(self.filepath).st_size
         self.header = self.read_header()
 
@@ -77,7 +115,6 @@ class App:
         self.should_show_ui = should_show_ui
         self.emulator_width = emulator_width or 500
         self.emulator_height = emulator_height or 200
-        self.max_ttyrec_height = 0
 
         terminal_size = shutil.get_terminal_size((80, 24))
         self.terminal_width = terminal_width or terminal_size.columns
@@ -89,52 +126,84 @@ class App:
         self.current_frame_time = 0
         self.speed = 1
         self.has_timecap = True
-        self.cache = []
+        # Cached frames are stored as parallel arrays indexed by frame
+        self.frames = []
+        self.timestamps = array("d")
+        self.durations = array("d")
+        self.cumulative_durations = array("d")
+        self.materialized = {}
+        self.previous_rows = {}
+        self.cursor_rows = set()
+        self.chars = {}
         self.current_frame = 1
         self.total_frames = 0
         self.tz = datetime.timezone(datetime.timedelta())
-        self.fg = {v: k for k, v in pyte.graphics.FG_ANSI.items()}
-        self.bg = {v: k for k, v in pyte.graphics.BG_ANSI.items()}
-        self.fg.update({v: k for k, v in pyte.graphics.FG_AIXTERM.items()})
-        self.bg.update({v: k for k, v in pyte.graphics.BG_AIXTERM.items()})
-        self.bg["brightmagenta"] = self.bg["bfightmagenta"]
+        self.dates = {}
+        self.formatted_durations = {}
+        # Every possible progress bar, indexed by play icon then progress
+        self.bars = {}
+        for play_icon in (">", "|"):
+            self.bars[play_icon] = [
+                f"[{'=' * (progress - 1) + play_icon if progress else play_icon}{'-' * (80 - max(progress, 1))}]"
+                for progress in range(81)
+            ]
+        self.last_ui = None
+        self.cell_cache = {}
+        self.sgr_cache = {}
+        self.line_cache = {}
+        self.frame_lines = {}
+        self.has_styles = False
+        self.rgb_fg = {}
+        self.rgb_bg = {}
 
     def quit(self):
-        for t in self.temp_files:
-            t.close()
-        self.file.close()
-        sys.stdout.write("\x1b[?25h")  # Show cursor
+        with self.lock:
+            self.header = None
+            for t in self.temp_files:
+                t.close()
+            if self.mapped_file:
+                self.mapped_view.release()
+                self.mapped_file.close()
+            self.file.close()
+        self.out.write(b"\x1b[?25h")  # Show cursor
+        self.out.flush()
         sys.exit(0)
 
     def run(self):
-        sys.stdout.write("\x1b[?25l")  # Hide cursor
+        self.out.write(b"\x1b[?25l")  # Hide cursor
         tty.setcbreak(sys.stdin)
         self.setup_terminal()
         self.load()
+        threading.Thread(target=self.load_all, daemon=True).start()
+        stdin = sys.stdin.fileno()
+        timeout = 0
         while True:
-            os.set_blocking(sys.stdin.fileno(), False)
-            if key := sys.stdin.read(1):
-                if key == "\x1b":
-                    key += sys.stdin.read(5)
-                self.on_press(key)
-            os.set_blocking(sys.stdin.fileno(), True)
-            self.load()
+            # Waiting on stdin until the next frame is due doubles as the frame timer
+            if select.select([stdin], [], [], timeout)[0]:
+                key = os.read(stdin, 1)
+                if key == b"\x1b" and select.select([stdin], [], [], 0)[0]:
+                    key += os.read(stdin, 5)
+                self.on_press(key.decode("latin-1"))
             if self.state == "quit":
                 self.quit()
             if self.is_dirty:
-                self.render_buffer(*self.cache[self.current_frame - 1][1])
+                self.render_buffer(self.current_frame - 1)
                 if self.should_show_ui:
                     self.show_ui()
+                # Frame and UI are buffered so they reach the terminal together
+                self.out.flush()
                 self.is_dirty = False
-            if self.state == "play":
-                duration = self.cache[self.current_frame - 1][2]
+            timeout = POLL_INTERVAL
+            if self.state == "play" and self.current_frame < self.total_frames:
+                duration = self.durations[self.current_frame - 1]
                 if self.has_timecap and duration > self.timecap_duration:
                     duration = self.timecap_duration
-                duration /= self.speed
-                if time.time() - self.current_frame_time >= duration and self.current_frame < self.total_frames:
+                remaining = self.current_frame_time + duration / self.speed - time.monotonic()
+                if remaining <= 0:
                     self.seek()
-            if not self.header:
-                time.sleep(min(self.timestep, 50) / 1000000)
+                    timeout = 0
+                elif remaining < timeout:
+                    timeout = remaining
 
     def seek(self, delta=0, pause=0.5):
         previous_frame = self.current_frame
@@ -142,12 +211,14 @@ class App:
             if self.mode == "frame":
                 self.current_frame += delta
             elif self.mode == "time":
-                total_duration = 0
-                while total_duration < abs(delta):
-                    total_duration += self.cache[self.current_frame - 1][2]
-                    self.current_frame += 1 if delta > 0 else -1
-                    if self.current_frame > self.total_frames or self.current_frame < 1:
-                        break
+                # Binary search the running total for the first frame far enough away
+                i = self.current_frame - 1
+                elapsed = self.cumulative_durations
+                if delta > 0:
+                    start = elapsed[i] - self.durations[i]
+                    self.current_frame = bisect_left(elapsed, start + delta, i) + 2
+                else:
+                    self.current_frame = bisect_right(elapsed, elapsed[i] + delta, 0, i)
         else:
             self.current_frame += 1
         if self.current_frame > self.total_frames:
@@ -158,21 +229,29 @@ class App:
             # After seeking (e.g. due to hotkey) a pause lets us wait to detect
             # new keypresses (of which the keypress signal is slower than the
             # frame duration) and reorient the viewer to the new frame.
-            self.current_frame_time = time.time() + (pause if delta else 0)
+            self.current_frame_time = time.monotonic() + (pause if delta else 0)
             self.is_dirty = True
             if self.current_frame != (previous_frame + 1):
                 self.is_jumping = True
 
     def show_ui(self):
-        timestamp = self.cache[self.current_frame - 1][0]
-        dt = (
-            datetime.datetime.fromtimestamp(timestamp, tz=self.tz)
-            .isoformat()
-            .split("+")[0]
-            .split(".")[0]
-            .replace("T", " ")
-        )
-        elapsed_time = int(timestamp - self.cache[0][0])
+        percent = None
+        if self.header:
+            if self.compressed_file:
+                percent = int(self.compressed_file.fileobj.tell() / self.total_bytes * 100)
+            else:
+                percent = int(self.bytes_processed / self.total_bytes * 100)
+        # Nothing to do if the UI is unchanged and still on screen
+        ui = (self.current_frame, self.total_frames, self.state, self.speed, self.mode, self.has_timecap, percent)
+        if ui == self.last_ui:
+            return
+        self.last_ui = ui
+        timestamp = self.timestamps[self.current_frame - 1]
+        # The date only changes once per second, not once per frame
+        if (dt := self.dates.get(int(timestamp))) is None:
+            dt = datetime.datetime.fromtimestamp(int(timestamp), tz=self.tz).strftime("%Y-%m-%d %H:%M:%S")
+            self.dates[int(timestamp)] = dt
+        elapsed_time = int(timestamp - self.timestamps[0])
         if self.mode == "frame":
             progress = int(self.current_frame / self.total_frames * 80)
             mode = "[Frame]"
@@ -181,43 +260,35 @@ class App:
             progress = int(elapsed_time / self.total_time * 80)
             mode = "[Time]"
             elapsed = f"{self.format_duration(elapsed_time)} / {self.format_duration(self.total_time)}"
-        remaining = 80 - progress
-        progress = "=" * progress
-        play_icon = ">" if self.state == "play" else "|"
-        if progress:
-            progress = progress[:-1] + play_icon
-        else:
-            progress = play_icon
-            remaining -= 1
-        remaining = "-" * remaining
-        bar = f"[{progress}{remaining}]"
-        if self.header:
-            percent = int(self.bytes_processed / self.total_bytes * 100)
+        # Out of order timestamps can put progress outside the bar
+        progress = min(max(progress, 0), 80)
+        bar = self.bars[">" if self.state == "play" else "|"][progress]
+        if percent is not None:
             loading = f"{percent}%"
             bar = bar[: -len(loading) - 1] + loading + "]"
         timecap = ""
         if self.has_timecap:
             timecap = " [Timecap]"
         # Show UI overlapping on top of bottom two lines
-        sys.stdout.write(f"\x1b[{self.terminal_height-1};1H\x1b[2M")
-        sys.stdout.write(bar)
-        sys.stdout.write(f"\n{dt} - {elapsed} - [{self.speed}X speed] {mode}{timecap}")
-        sys.stdout.flush()
+        status = f"{dt} - {elapsed} - [{self.speed}X speed] {mode}{timecap}"
+        self.out.write(f"\x1b[{self.terminal_height-1};1H\x1b[2M{bar}\n{status}".encode())
+        if self.displayed_lines:
+            # The bottom two lines now hold the UI, not the recording
+            self.displayed_lines[-2:] = [None, None]
 
     def format_duration(self, seconds):
-        h, m, s = str(datetime.timedelta(seconds=seconds)).split(".")[0].split(":")
+        seconds = int(seconds)
+        if (elapsed := self.formatted_durations.get(seconds)) is not None:
+            return elapsed
+        h, remainder = divmod(seconds, 3600)
+        m, s = divmod(remainder, 60)
         elapsed = ""
-        if h != "0":
-            if h.startswith("0"):
-                h = h[1:]
+        if h:
             elapsed = f"{h}h "
-        if m != "00":
-            if m.startswith("0"):
-                m = m[1:]
+        if m:
             elapsed += f"{m}m "
-        if s.startswith("0"):
-            s = s[1:]
         elapsed += f"{s}s"
+        self.formatted_durations[seconds] = elapsed
         return elapsed
 
     def render(self):
@@ -225,61 +296,170 @@ class App:
         cursor_y = self.screen.cursor.y
         total_lines = self.screen.lines
         total_columns = self.screen.columns
-        lines = [" " * total_columns] * total_lines
+        render_cell = self.render_cell
+        join = b"".join
+        lines = [b" " * total_columns] * total_lines
         for y, row in self.screen.buffer.items():
-            line = [" "] * total_columns
+            line = [b" "] * total_columns
             for x, cell in row.items():
-                line[x] = self.render_cell(cell, is_cursor=x == cursor_x and y == cursor_y)
-            lines[y] = "".join(line)
-        return "\n".join(lines)
+                line[x] = render_cell(cell, x == cursor_x and y == cursor_y)
+            lines[y] = join(line)
+        return b"\n".join(lines)
 
     def copy_buffer(self):
-        try:
-            # We only autodetect height because it's cheap.
-            self.max_ttyrec_height = max(max(self.screen._buffer.keys()) + 1, self.max_ttyrec_height)
-        except:
-            pass
-        return (
-            self.screen.cursor.x,
-            self.screen.cursor.y,
-            {y: dict(row) for y, row in self.screen._buffer.items()},
-            self.screen.dirty.copy(),
-        )
-
-    def render_buffer(self, cursor_x, cursor_y, buffer, dirty):
-        total_columns = min(self.terminal_width, self.emulator_width)
+        buffer = self.screen._buffer
+        cursor = self.screen.cursor
+        previous = self.previous_rows
+        # Lines are often redrawn unchanged, so only keep the ones that differ from the last frame.
+        # Lines that were or will be drawn with the cursor on them are kept so it gets redrawn.
+        cursor_rows = self.cursor_rows
+        cursor_rows.add(cursor.y)
+        dirty = {y for y in self.screen.dirty if y in cursor_rows or buffer.get(y, {}) != previous.get(y, {})}
+        cursor_rows.difference_update(dirty)
+        cursor_rows.add(cursor.y)
+        # pyte makes a new Char for every write, so share one copy of each across the cache
+        chars = self.chars
+        known = len(chars)
+        intern = chars.setdefault
+        for y in dirty:
+            previous[y] = {x: intern(cell, cell) for x, cell in buffer.get(y, {}).items()}
+        if len(self.frames) % KEYFRAME_INTERVAL == 0:
+            # Keyframes share the copies already made of unchanged lines
+            rows = {
+                y: previous[y] if y in previous else {x: intern(cell, cell) for x, cell in row.items()}
+                for y, row in buffer.items()
+            }
+            previous.clear()
+            previous.update(rows)
+        else:
+            rows = {y: previous[y] for y in dirty}
+        if not self.has_styles and len(chars) > known:
+            # Only cells never seen before can be the first styled ones
+            for cell in islice(reversed(chars), len(chars) - known):
+                if (
+                    cell.fg != "default"
+                    or cell.bg != "default"
+                    or cell.bold
+                    or cell.italics
+                    or cell.underscore
+                    or cell.reverse
+                ):
+                    self.has_styles = True
+                    break
+        return (cursor.x, cursor.y, rows, dirty)
+
+    def materialize(self, i):
+        # Rebuild a full buffer from the nearest keyframe and subsequent diffs
+        keyframe = i - i % KEYFRAME_INTERVAL
+        # Frames are rendered straight away, so one working dict is reused
+        buffer = self.materialized
+        buffer.clear()
+        buffer.update(self.frames[keyframe][2])
+        for frame in self.frames[keyframe + 1 : i + 1]:
+            buffer.update(frame[2])
+        return buffer
+
+    def render_buffer(self, i):
+        cursor_x, cursor_y, buffer, dirty = self.frames[i]
+        total_columns = self.total_columns
+        # Bind hot lookups to locals for the per-line loops below
+        render_line = self.render_line
+        render_cell = self.render_cell if self.has_styles else self.render_plain_cell
+        # Collect the whole frame so it reaches the terminal in a single write
+        out = bytearray()
+        displayed = self.displayed_lines
         if self.is_jumping:  # Redraw entire screen
-            lines = [" " * total_columns] * min(self.terminal_height, self.max_ttyrec_height)
-            for y, row in buffer.items():
-                line = [" "] * total_columns
-                for x, cell in row.items():
-                    try:
-                        line[x] = self.render_cell(cell, is_cursor=x == cursor_x and y == cursor_y)
-                    except IndexError:
-                        pass
-                try:
-                    lines[y] = "".join(line)
-                except IndexError:
-                    pass
-            sys.stdout.write("\x1b[2J\x1b[H")  # Clear screen
-            sys.stdout.write("\n".join(lines))
+            # Scrubbing back and forth revisits frames, so keep their rendered lines
+            key = (i, self.has_styles)
+            if (lines := self.frame_lines.get(key)) is None:
+                if len(self.frame_lines) > 256:
+                    self.frame_lines.clear()
+                lines = self.frame_lines[key] = [b""] * self.terminal_height
+                for y, row in self.materialize(i).items():
+                    # Rows below the terminal would be clamped onto its last line
+                    if not row or y >= self.terminal_height:
+                        continue
+                    lines[y] = render_line(row, cursor_x if y == cursor_y else None, total_columns, render_cell)
+            if displayed is None:
+                out += b"\x1b[2J\x1b[H"  # Clear screen
+                out += b"\n".join(lines)
+            else:
+                # Only lines that differ from what is on screen need rewriting
+                for y, line in enumerate(lines):
+                    if line != displayed[y]:
+                        out += self.clear_line_at[y]
+                        out += line
+            self.displayed_lines = lines.copy()
+            self.last_ui = None
             self.is_jumping = False
         else:  # Redraw only dirty lines
             for y in dirty:
-                sys.stdout.write(f"\x1b[{y+1};1H\x1b[K")  # Clear line
-                line = [" "] * total_columns
-                for x, cell in buffer.get(y, {}).items():
-                    try:
-                        line[x] = self.render_cell(cell, is_cursor=x == cursor_x and y == cursor_y)
-                    except:
-                        pass
-                sys.stdout.write("".join(line))
-        sys.stdout.flush()
+                if y >= self.terminal_height:
+                    continue
+                out += self.clear_line_at[y]  # Clear line
+                if y >= self.terminal_height - 2:
+                    self.last_ui = None
+                if not (row := buffer.get(y)):
+                    line = b""
+                else:
+                    line = render_line(row, cursor_x if y == cursor_y else None, total_columns, render_cell)
+                    out += line
+                if displayed:
+                    displayed[y] = line
+        self.out.write(out)
+
+    def render_line(self, row, cursor_x, total_columns, render_cell):
+        # Status lines and map rows repeat across frames, so memoise whole lines per cell renderer
+        key = (tuple(row), tuple(row.values()), cursor_x, total_columns, render_cell)
+        if (result := self.line_cache.get(key)) is not None:
+            return result
+        if len(self.line_cache) > 10000:
+            self.line_cache.clear()
+        # Lines are only drawn onto cleared space, so gaps are skipped rather than padded
+        line = bytearray()
+        next_x = 0
+        for x in sorted(row):
+            if x >= total_columns:
+                break
+            # pyte keeps the default spaces left by erases, which look the same as cleared space
+            if (cell := render_cell(row[x], x == cursor_x)) == b" ":
+                continue
+            if (gap := x - next_x) > 3:
+                line += b"\x1b[%dC" % gap
+            elif gap:
+                line += b" " * gap
+            line += cell
+            next_x = x + 1
+        result = self.line_cache[key] = bytes(line)
+        return result
 
     def render_cell(self, cell, is_cursor=False):
-        fg = cell.fg
-        bg = cell.bg
-        if cell.reverse:
+        # Most cells are unstyled, so skip the attribute logic for them
+        if (
+            not is_cursor
+            and cell.fg == "default"
+            and cell.bg == "default"
+            and not (cell.bold or cell.italics or cell.underscore or cell.reverse)
+        ):
+            data = cell.data or " "
+            if (result := self.cell_cache.get(data)) is None:
+                result = self.cell_cache[data] = data.encode(self.out_encoding)
+            return result
+        # Recordings reuse a small set of styled characters, so memoise them.
+        key = (cell, is_cursor)
+        if (result := self.cell_cache.get(key)) is not None:
+            return result
+        if len(self.cell_cache) > 200000:
+            self.cell_cache.clear()
+        # Only a handful of distinct styles exist, so their escapes are shared
+        style = (cell.fg, cell.bg, cell.bold, cell.italics, cell.underscore, cell.reverse, is_cursor)
+        if (sgr := self.sgr_cache.get(style)) is None:
+            sgr = self.sgr_cache[style] = self.render_sgr(*style)
+        result = self.cell_cache[key] = sgr[0] + (cell.data or " ").encode(self.out_encoding) + sgr[1]
+        return result
+
+    def render_sgr(self, fg, bg, bold, italics, underscore, reverse, is_cursor):
+        if reverse:
             fg, bg = bg, fg
             if bg == "default":
                 bg = "white"
@@ -290,71 +470,106 @@ class App:
             bg = "white"
         indexed_colours = []
         rgb_colours = []
-        try:
-            indexed_colours.append(str(self.fg[fg]))
-        except:
-            rgb_colours.append(f"\033[38;2;{int(fg[0:2], 16)};{int(fg[2:4], 16)};{int(fg[4:6], 16)}m")
-        try:
-            indexed_colours.append(str(self.bg[bg]))
-        except:
-            rgb_colours.append(f"\033[48;2;{int(bg[0:2], 16)};{int(bg[2:4], 16)};{int(bg[4:6], 16)}m")
-        if cell.bold:
+        if (code := FG.get(fg)) is not None:
+            indexed_colours.append(code)
+        else:
+            if (rgb := self.rgb_fg.get(fg)) is None:
+                rgb = self.rgb_fg[fg] = f"\033[38;2;{int(fg[0:2], 16)};{int(fg[2:4], 16)};{int(fg[4:6], 16)}m"
+            rgb_colours.append(rgb)
+        if (code := BG.get(bg)) is not None:
+            indexed_colours.append(code)
+        else:
+            if (rgb := self.rgb_bg.get(bg)) is None:
+                rgb = self.rgb_bg[bg] = f"\033[48;2;{int(bg[0:2], 16)};{int(bg[2:4], 16)};{int(bg[4:6], 16)}m"
+            rgb_colours.append(rgb)
+        if bold:
             indexed_colours.append("1")
-        if cell.italics:
+        if italics:
             indexed_colours.append("3")
-        if cell.underscore:
+        if underscore:
             indexed_colours.append("4")
-        result = []
+        prefix = []
         if indexed_colours:
-            result.append(f"\033[{';'.join(indexed_colours)}m")
-        result.extend(rgb_colours)
-        result.append(cell.data or " ")
-        if indexed_colours or rgb_colours:
-            result.append("\033[m")
-        return "".join(result)
+            prefix.append(f"\033[{';'.join(indexed_colours)}m")
+        prefix.extend(rgb_colours)
+        suffix = "\033[m" if indexed_colours or rgb_colours else ""
+        return ("".join(prefix).encode(), suffix.encode())
+
+    def render_plain_cell(self, cell, is_cursor=False):
+        # Used while nothing loaded so far has styled any text
+        if is_cursor:
+            return self.render_cell(cell, is_cursor)
+        data = cell.data or " "
+        if (result := self.cell_cache.get(data)) is None:
+            result = self.cell_cache[data] = data.encode(self.out_encoding)
+        return result
 
     def setup_terminal(self):
         self.screen = pyte.Screen(self.emulator_width, self.emulator_height)
+        self.total_columns = min(self.terminal_width, self.emulator_width)
+        self.clear_line_at = [f"\x1b[{y+1};1H\x1b[K".encode() for y in range(self.terminal_height)]
+        # What each terminal line currently shows, so jumps can skip unchanged lines
+        self.displayed_lines = None
         self.stream = pyte.Stream(self.screen)
         # pyte DEC graphics https://github.com/selectel/pyte/issues/182
         self.stream.use_utf8 = False
 
     def read_header(self):
-        seconds = int.from_bytes(self.file.read(4), byteorder="little")
-        useconds = int.from_bytes(self.file.read(4), byteorder="little")
-        length = int.from_bytes(self.file.read(4), byteorder="little")
-        self.bytes_processed += 12
+        # Headers are parsed as loading reaches them, so playback never waits on a pre-scan
+        offset = self.next_offset
+        if self.mapped_file:
+            # Unpack straight out of the map, no reads or seeks needed
+            if offset + HEADER.size > len(self.mapped_file):
+                return
+            seconds, useconds, length = HEADER.unpack_from(self.mapped_file, offset)
+        else:
+            if len(header := self.file.read(HEADER.size)) < HEADER.size:
+                return
+            seconds, useconds, length = HEADER.unpack(header)
+        self.bytes_processed += HEADER.size
         if length:
+            self.payload_offset = offset + HEADER.size
+            self.payload_length = length
+            self.next_offset = self.payload_offset + length
             return (seconds + useconds / 1000000, length)
 
+    def read_payload(self):
+        offset = self.payload_offset
+        if self.mapped_file:
+            # A view slice hands the decoder the mapped bytes without copying
+            return self.mapped_view[offset : offset + self.payload_length]
+        return self.file.read(self.payload_length)
+
     def guess_encoding(self):
-        self.encoding = self.possible_encodings.pop(0)
-        self.header = self.read_header()
-        errors = 0
-        while self.header:
-            _, length = self.header
-            if not (payload := self.file.read(length)):
-                break
-            if self.truncated_payload:
-                payload = self.truncated_payload + payload
+        for encoding in self.possible_encodings:
+            # An incremental decoder copes with characters split across frames
+            decoder = codecs.getincrementaldecoder(encoding)()
             try:
-                payload = payload.decode(self.encoding)
-                errors = 0
-                self.truncated_payload = None
+                while self.read_header():
+                    decoder.decode(self.read_payload())
             except UnicodeDecodeError:
-                # Probably the payload is split halfway
-                self.truncated_payload = payload
-                errors += 1
-                if errors > 3:
-                    if not self.possible_encodings:
-                        print("No suitable encoding found. If you know what it is, specify it with `-e`")
-                        self.quit()
-                    self.encoding = self.possible_encodings.pop(0)
-                    errors = 0
-                    self.file.seek(0)
-            self.header = self.read_header()
-        self.file.seek(0)
-        self.bytes_processed = 0
+                continue
+            finally:
+                self.file.seek(0)
+                self.next_offset = 0
+                self.bytes_processed = 0
+            self.encoding = encoding
+            return
+        print("No suitable encoding found. If you know what it is, specify it with `-e`")
+        self.quit()
+
+    def load_all(self):
+        # Runs on a background thread so playback starts before loading ends
+        load = self.load
+        lock = self.lock
+        while self.header:
+            with lock:
+                load()
+        # The cached frames live until exit, so keep them out of future collections.
+        # Collecting first frees any cycles left from loading instead of freezing them.
+        gc.collect()
+        gc.freeze()
+        gc.enable()
 
     def load(self):
         if not self.header:
@@ -363,34 +578,41 @@ class App:
         if self.i % 500 == 0:
             self.is_dirty = True
         self.bytes_processed += length
-        if not (payload := self.file.read(length)):
+        if not (payload := self.read_payload()):
             self.header = None
             self.is_dirty = True
             return
-        if self.truncated_payload:
-            payload = self.truncated_payload + payload
-        try:
-            payload = payload.decode(self.encoding)
-            self.truncated_payload = None
-            self.stream.feed(payload)
-        except UnicodeDecodeError:
-            # Probably the payload is split halfway
-            self.truncated_payload = payload
+        if payload := self.decoder.decode(payload):
+            self.pending.append(payload)
         self.header = self.read_header()
         if self.header:
             duration = self.header[0] - timestamp
-            if self.i == 0 or duration >= (self.timestep / 1000000):
-                self.cache.append([timestamp, self.copy_buffer(), duration])
+            if self.i == 0 or duration >= self.min_duration:
+                self.feed_pending()
+                self.cache_frame(timestamp, duration)
                 self.screen.dirty.clear()
-                # self.cache.append([timestamp, self.render(), duration])
         else:
-            self.cache.append([timestamp, self.copy_buffer(), 0])
+            self.feed_pending()
+            self.cache_frame(timestamp, 0)
             self.header = None
             self.is_dirty = True
             return
         self.i += 1
-        self.total_frames = len(self.cache)
-        self.total_time = timestamp - self.cache[0][0]
+        self.total_frames = len(self.frames)
+        self.total_time = timestamp - self.timestamps[0]
+
+    def feed_pending(self):
+        # Payloads merged into one frame reach pyte in a single feed
+        payload = "".join(self.pending)
+        self.pending.clear()
+        self.stream.feed(payload)
+
+    def cache_frame(self, timestamp, duration):
+        self.frames.append(self.copy_buffer())
+        self.timestamps.append(timestamp)
+        self.durations.append(duration)
+        elapsed = self.cumulative_durations
+        elapsed.append((elapsed[-1] if elapsed else 0) + duration)
 
     def on_press(self, key):
         self.is_dirty = True
@@ -517,7 +739,8 @@ def parse_primitive(fn, x, default):
 emulator_width, emulator_height = parse_size(args.size)
 terminal_width, terminal_height = parse_size(args.terminal_size)
 
-gc.set_threshold(0)
+# Collecting while loading only rescans the growing frame cache
+gc.disable()
 App(
     args.filepath,
     emulator_width=emulator_width,